@@ -1,13 +1,25 @@
 # Bitwave Balance Validator Streamlit App (Avalanche)
 # (see conversation for detailed code; full working version included here)
 
-import os, io, json, time, math, base64, pytz, datetime as dt, requests
+import os, io, re, json, time, math, base64, datetime as dt, requests
+import asyncio, functools, hashlib, sqlite3, threading
+import aiohttp
+import orjson
+from zoneinfo import ZoneInfo, available_timezones
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import streamlit as st
-from dataclasses import dataclass
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from dataclasses import dataclass, astuple
+from decimal import Context, Decimal, DecimalException, MAX_PREC
 from typing import Optional
 from web3 import Web3
 from web3.exceptions import ContractLogicError
+from eth_abi import encode, decode
 
 # Setup
 st.set_page_config(page_title="Bitwave Balance Validator (Multi-Chain)", layout="wide")
@@ -19,28 +31,35 @@ CHAIN_CONFIG = {
         "name": "Avalanche C-Chain",
         "rpc": os.getenv("AVALANCHE") or (st.secrets.get("rpc", {}).get("AVALANCHE") if hasattr(st, "secrets") else None),
         "native_token": "AVAX",
+        "block_time": 2.0,
         "aliases": ["avax", "avalanche", "avax-c", "avalanche c-chain", "avalanche c chain"]
     },
     "ETH": {
         "name": "Ethereum Mainnet",
         "rpc": os.getenv("ETHEREUM") or (st.secrets.get("rpc", {}).get("ETHEREUM") if hasattr(st, "secrets") else None),
         "native_token": "ETH",
+        "block_time": 12.0,
         "aliases": ["eth", "ethereum", "ethereum mainnet", "mainnet"]
     },
     "ARB": {
         "name": "Arbitrum One",
         "rpc": os.getenv("ARBITRUM") or (st.secrets.get("rpc", {}).get("ARBITRUM") if hasattr(st, "secrets") else None),
         "native_token": "ETH",
+        "block_time": 0.25,
         "aliases": ["arb", "arbitrum", "arbitrum one", "arb1"]
     },
     "BASE": {
         "name": "Base",
         "rpc": os.getenv("BASE") or (st.secrets.get("rpc", {}).get("BASE") if hasattr(st, "secrets") else None),
         "native_token": "ETH",
+        "block_time": 2.0,
         "aliases": ["base", "base mainnet"]
     }
 }
 
+# Lowercase alias -> chain key, for mapping the blockchain column in one vectorized pass
+ALIAS_TO_CHAIN = {alias: chain_key for chain_key, config in CHAIN_CONFIG.items() for alias in config["aliases"]}
+
 # Debug: Show what secrets are being loaded (mask the API key)
 if hasattr(st, "secrets"):
     try:
@@ -61,11 +80,65 @@ if not configured_chains:
 
 st.success(f"✅ Configured chains: {', '.join([v['name'] for v in configured_chains.values()])}")
 
-ERC20_ABI = [
-    {"constant": True, "inputs": [], "name": "decimals", "outputs": [{"name": "", "type": "uint8"}], "type": "function"},
-    {"constant": True, "inputs": [], "name": "symbol", "outputs": [{"name": "", "type": "string"}], "type": "function"},
-    {"constant": True, "inputs": [{"name": "account", "type": "address"}], "name": "balanceOf", "outputs": [{"name": "", "type": "uint256"}], "type": "function"},
-]
+# decimals() of mainstream tokens, so typical reports need no decimals RPC at all (lowercase addresses)
+KNOWN_DECIMALS = {
+    "AVAX": {
+        "0xb97ef9ef8734c71904d8002f8b6bc66dd9c48a6e": 6,   # USDC
+        "0x9702230a8ea53601f5cd2dc00fdbc13d4df4a8c7": 6,   # USDT
+        "0xa7d7079b0fead91f3e65f86e8915cb59c1a4c664": 6,   # USDC.e
+        "0xc7198437980c041c805a1edcba50c1ce5db95118": 6,   # USDT.e
+        "0xb31f66aa3c1e785363f0875a1b74e27b85fd66c7": 18,  # WAVAX
+        "0x49d5c2bdffac6ce2bfdb6640f4f80f226bc10bab": 18,  # WETH.e
+        "0xd586e7f844cea2f87f50152665bcbc2c279d8d70": 18,  # DAI.e
+        "0x50b7545627a5162f82a992c33b87adc75187b218": 8,   # WBTC.e
+        "0x152b9d0fdc40c096757f570a51e494bd4b943e50": 8,   # BTC.b
+    },
+    "ETH": {
+        "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48": 6,   # USDC
+        "0xdac17f958d2ee523a2206206994597c13d831ec7": 6,   # USDT
+        "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2": 18,  # WETH
+        "0x6b175474e89094c44da98b954eedeac495271d0f": 18,  # DAI
+        "0x2260fac5e5542a773aa44fbcfedf7c193bc2c599": 8,   # WBTC
+    },
+    "ARB": {
+        "0xaf88d065e77c8cc2239327c5edb3a432268e5831": 6,   # USDC
+        "0xff970a61a04b1ca14834a43f5de4533ebddb5cc8": 6,   # USDC.e
+        "0xfd086bc7cd5c481dcc9c85ebe478a1c0b69fcbb9": 6,   # USDT
+        "0x82af49447d8a07e3bd95bd0d56f35241523fbab1": 18,  # WETH
+        "0x912ce59144191c1204e64559fe8253a0e49e6548": 18,  # ARB
+        "0x2f2a2543b76a4166549f7aab2e75bef0aefc5b0f": 8,   # WBTC
+    },
+    "BASE": {
+        "0x833589fcd6edb6e08f4c7c32d4f71b54bda02913": 6,   # USDC
+        "0xd9aaec86b65d86f6a7b5b1b0c42ffa531710b6ca": 6,   # USDbC
+        "0x4200000000000000000000000000000000000006": 18,  # WETH
+        "0x50c5725949a6f0c72e6c4a641f24049a917db0cb": 18,  # DAI
+    },
+}
+
+# Multicall3 is deployed at the same address on every supported chain
+MULTICALL3 = "0xcA11bde05977b3631167028862bE2a173976CA11"
+MULTICALL_BATCH_SIZE = 500  # calls per aggregate3 request
+RPC_CONCURRENCY = 30        # max in-flight JSON-RPC requests per endpoint
+
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")     # aggregate3((address,bool,bytes)[])
+BALANCE_OF_SELECTOR = bytes.fromhex("70a08231")     # balanceOf(address)
+DECIMALS_SELECTOR = bytes.fromhex("313ce567")       # decimals()
+GET_ETH_BALANCE_SELECTOR = bytes.fromhex("4d2301cc")  # getEthBalance(address)
+
+# Address validators, compiled once and applied column-wide with .str.match
+_ADDR_RE = re.compile(r'^0[xX][0-9a-fA-F]{40}$')      # token contract; anything else is the native token
+_WALLET_RE = re.compile(r'^(0[xX])?[0-9a-fA-F]{40}$')  # wallet, 0x/0X prefix optional
+
+NATIVE_DECIMALS = 18  # native tokens on every supported chain use 18 decimals
+
+# Timezone selectbox options: the tz database scan and sort run once per process, not on every rerun
+@st.cache_resource
+def _tz_options():
+    tzs = sorted(available_timezones() - {"Factory", "localtime"})  # not real zones a user would pick
+    return tzs, tzs.index("UTC")
+
+_TZS, _TZ_UTC_IDX = _tz_options()
 
 @dataclass
 class ColumnMap:
@@ -75,134 +148,425 @@ class ColumnMap:
     token_contract: Optional[str]
     reported_balance: str
 
-def _is_native(token_address):
-    if token_address is None: return True
-    s = str(token_address).strip().lower()
-    # Check for empty, N/A, or non-hex strings
-    if s in {"", "n/a", "na", "none", "nan"}: return True
-    # Check if it's a valid hex address (starts with 0x and is 42 chars)
-    if not s.startswith("0x"): return True
-    if len(s) != 42: return True
-    # Check if it contains only valid hex characters after 0x
-    try:
-        int(s, 16)  # Will raise ValueError if not valid hex
-    except ValueError:
-        return True
-    return False
-
-def human_to_decimal(val):
-    try:
-        if pd.isna(val): return None
-        return float(str(val).replace(',', '').strip())
-    except: return None
-
 @st.cache_resource
 def make_w3(rpc):
     from web3.middleware import ExtraDataToPOAMiddleware
     try:
+        # Pooled keep-alive session with retry/backoff on rate limits and gateway errors.
+        # JSON-RPC reads are POSTs, which urllib3 does not retry unless allowed explicitly.
+        session = requests.Session()
+        retry = Retry(total=5, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504], allowed_methods=frozenset({"POST"}))
+        adapter = HTTPAdapter(pool_connections=64, pool_maxsize=64, max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
         # Add timeout to prevent hanging
-        w3 = Web3(Web3.HTTPProvider(rpc, request_kwargs={'timeout': 30}))
+        w3 = Web3(Web3.HTTPProvider(rpc, session=session, request_kwargs={'timeout': 30}))
         # Inject POA middleware to handle chains with extra data in blocks (Avalanche, etc.)
         w3.middleware_onion.inject(ExtraDataToPOAMiddleware, layer=0)
+        # The validation middleware costs two extra eth_chainId round-trips per eth_call to check a chainId
+        # field these read-only calls never set; block extraData is already handled by the POA middleware
+        w3.middleware_onion.remove("validation")
         return w3
     except Exception as e:
         st.error(f"Failed to connect to RPC: {rpc}. Error: {str(e)}")
         raise
 
-def identify_chain(chain_value):
-    """Identify which chain based on the blockchain column value"""
-    if not chain_value or pd.isna(chain_value):
-        return None
-    
-    chain_str = str(chain_value).strip().lower()
-    
-    for chain_key, config in CHAIN_CONFIG.items():
-        if chain_str in config["aliases"]:
-            return chain_key
-    
-    return None
+@functools.lru_cache(maxsize=65536)
+def _ck(addr):
+    """Checksum form of a lowercase address; each one costs a keccak hash, and wallets/tokens repeat across lookups"""
+    return Web3.to_checksum_address(addr)
 
+@st.cache_data(ttl=3600, show_spinner=False)
 def fetch_native(rpc, addr, blk): 
-    return make_w3(rpc).eth.get_balance(Web3.to_checksum_address(addr), blk)
+    return make_w3(rpc).eth.get_balance(_ck(addr), blk)
+
+@st.cache_data(max_entries=4096, show_spinner=False)
+def _block_ts(rpc, n):
+    """Timestamp of block n; a mined block's timestamp never changes, so keep it across searches and reruns"""
+    return make_w3(rpc).eth.get_block(n).timestamp
+
+def prewarm_block_ts(rpc, blocks):
+    """Fetch timestamps for several independent blocks concurrently into the _block_ts cache"""
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        list(ex.map(lambda n: _block_ts(rpc, n), set(blocks)))
 
 @st.cache_data(ttl=3600)
-def find_block_by_timestamp(rpc, target_ts):
-    """Binary search to find block closest to target timestamp"""
+def find_block_by_timestamp(rpc, target_ts, avg_block_time=2.0, margin_seconds=15):
+    """Find block closest to target timestamp: estimate from the recent average block time,
+    probe outward exponentially until the target is bracketed, then binary search the bracket.
+    Any block within margin_seconds of the target is accepted; pass 0 for the closest block.
+    Returns (block, note) where note is an optional (level, message) for the caller to render."""
     w3 = make_w3(rpc)
+    block_ts = {}  # block number -> timestamp for blocks probed by this search
+
+    def ts(n):
+        if n not in block_ts:
+            block_ts[n] = _block_ts(rpc, n)
+        return block_ts[n]
+
     latest_block = w3.eth.block_number
-    latest_ts = w3.eth.get_block(latest_block).timestamp
+    prewarm_block_ts(rpc, [latest_block, max(latest_block - 500, 0)])
+    latest_ts = ts(latest_block)
     
     # Check if target is in the future
     if target_ts >= latest_ts:
-        st.warning(f"⚠️ Target timestamp is in the future. Using latest block {latest_block}.")
-        return latest_block
+        return latest_block, ("warning", f"⚠️ Target timestamp is in the future. Using latest block {latest_block}.")
     
     # Check if target is too far in the past
-    genesis_block = w3.eth.get_block(0)
-    if target_ts < genesis_block.timestamp:
-        st.error(f"❌ Target timestamp is before genesis block. Using block 0.")
-        return 0
+    if target_ts < ts(0):
+        return 0, ("error", "❌ Target timestamp is before genesis block. Using block 0.")
+    
+    # Measure the block time over the last 500 blocks; the configured value is only a fallback
+    if latest_block > 500 and latest_ts > ts(latest_block - 500):
+        avg_block_time = (latest_ts - ts(latest_block - 500)) / 500
     
-    # Binary search
-    low, high = 0, latest_block
-    closest_block = latest_block
-    closest_diff = abs(latest_ts - target_ts)
+    # Initial estimate assuming a constant block time back from the tip
+    est = min(max(latest_block - int((latest_ts - target_ts) / avg_block_time), 0), latest_block)
+    if abs(ts(est) - target_ts) < margin_seconds:
+        return est, None
     
+    # Exponential probe outward from the estimate: the first bracket spans about an hour of
+    # blocks (or the estimate's remaining error), and doubles only if the target lies outside
+    step = max(100, int(3600 / avg_block_time), int(abs(ts(est) - target_ts) / avg_block_time))
+    if ts(est) > target_ts:
+        low, high = max(est - step, 0), est
+        while low > 0 and ts(low) > target_ts:
+            high = low
+            step *= 2
+            low = max(est - step, 0)
+    else:
+        low, high = est, min(est + step, latest_block)
+        while high < latest_block and ts(high) < target_ts:
+            low = high
+            step *= 2
+            high = min(est + step, latest_block)
+    
+    # Binary search inside the bracket
     iterations = 0
     max_iterations = 100  # Safety limit
     
     while low <= high and iterations < max_iterations:
         mid = (low + high) // 2
-        block = w3.eth.get_block(mid)
-        block_ts = block.timestamp
-        diff = abs(block_ts - target_ts)
-        
-        if diff < closest_diff:
-            closest_block = mid
-            closest_diff = diff
+        diff = abs(ts(mid) - target_ts)
         
-        # If we're within 15 seconds, that's close enough
-        if diff < 15:
-            return mid
+        # Within the margin is close enough
+        if diff < margin_seconds:
+            return mid, None
         
-        if block_ts < target_ts:
+        if ts(mid) < target_ts:
             low = mid + 1
-        elif block_ts > target_ts:
+        elif ts(mid) > target_ts:
             high = mid - 1
         else:
-            return mid
+            return mid, None
         
         iterations += 1
     
-    # Verify the result
-    result_block = w3.eth.get_block(closest_block)
-    result_ts = result_block.timestamp
-    time_diff = abs(result_ts - target_ts)
+    # Every probed block is in block_ts, so no extra get_block is needed to pick the closest
+    closest_block = min(block_ts, key=lambda n: abs(block_ts[n] - target_ts))
+    time_diff = abs(block_ts[closest_block] - target_ts)
     
-    st.success(f"✅ Found block {closest_block} (timestamp difference: {time_diff} seconds)")
+    return closest_block, ("success", f"✅ Found block {closest_block} (timestamp difference: {time_diff} seconds)")
+
+# On-disk (chain, timestamp) -> block table, so block searches survive process restarts
+BLOCK_CACHE_PATH = os.getenv("BLOCK_CACHE_PATH", "/tmp/bitwave_block_cache.sqlite")
+
+@st.cache_resource
+def _block_cache():
+    """Shared connection (None if the file can't be opened) plus the lock that serializes its use across sessions
+    and threads. The cache is best-effort: sqlite errors count as a miss and never fail a lookup."""
+    try:
+        conn = sqlite3.connect(BLOCK_CACHE_PATH, check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS blocks (chain TEXT, ts INTEGER, block INTEGER, PRIMARY KEY (chain, ts))")
+    except sqlite3.Error:
+        conn = None
+    return conn, threading.Lock()
+
+def block_for_timestamp(chain_id, target_ts):
+    """find_block_by_timestamp backed by the on-disk cache; returns (block, note)"""
+    conn, lock = _block_cache()
+    hit = None
+    if conn is not None:
+        try:
+            with lock:
+                hit = conn.execute("SELECT block FROM blocks WHERE chain = ? AND ts = ?", (chain_id, target_ts)).fetchone()
+        except sqlite3.Error:
+            conn = None  # unreadable cache: search, and don't try to persist either
+    if hit:
+        return hit[0], None
+    chain_config = CHAIN_CONFIG[chain_id]
+    blk, note = find_block_by_timestamp(chain_config["rpc"], target_ts, chain_config["block_time"])
+    # Only persist settled history; a recent/future target resolves to the moving chain tip.
+    # Fallbacks (future target -> tip, pre-genesis -> block 0) are not stored, so their warning shows on every run.
+    fallback = note is not None and note[0] != "success"
+    if conn is not None and target_ts < time.time() - 3600 and not fallback:
+        try:
+            with lock, conn:
+                conn.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?)", (chain_id, target_ts, blk))
+        except sqlite3.Error:
+            pass  # e.g. read-only or full disk: the block is still returned, just not remembered
+    return blk, note
+
+# The fetch_* helpers raise on failure rather than returning a fallback: st.cache_data does not store
+# exceptions, so a transient RPC error is retried on the next run instead of being served for an hour.
+@st.cache_data(show_spinner=False)
+def fetch_token_decimals(rpc, token):
+    # Raw eth_call with the precomputed selector; skips web3.py's contract-object encode/decode path
+    ret = make_w3(rpc).eth.call({"to": _ck(token), "data": DECIMALS_SELECTOR})
+    if len(ret) < 32:  # no code at the address, or not an ERC20
+        raise ValueError(f"decimals() returned no data for {token}")
+    decimals = int.from_bytes(ret[:32], 'big')
+    if decimals > 255:  # not a uint8; a strict ABI decode rejects it too
+        raise ValueError(f"decimals() returned {decimals} for {token}")
+    return decimals
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_erc20(rpc, token, addr, blk):
+    ret = make_w3(rpc).eth.call({"to": _ck(token), "data": BALANCE_OF_SELECTOR + encode(['address'], [addr])}, blk)
+    if len(ret) < 32:
+        raise ValueError(f"balanceOf() returned no data for {token}")
+    return int.from_bytes(ret[:32], 'big')
+
+@st.cache_resource
+def _rpc_loop():
+    """One event loop on a daemon thread for all async RPC, plus its per-endpoint (session, semaphore) table.
+    Keeping both alive across calls and reruns lets aiohttp reuse its keep-alive connections."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="rpc-loop").start()
+    return loop, {}
+
+async def _post_rpc(session, sem, rpc, req_id, method, params):
+    async with sem:
+        payload = orjson.dumps({"jsonrpc": "2.0", "id": req_id, "method": method, "params": params})
+        async with session.post(rpc, data=payload, headers={"Content-Type": "application/json"}) as resp:
+            body = orjson.loads(await resp.read())
+    return body.get("result")
+
+async def _gather_rpc(rpc, calls, endpoints):
+    # Runs on the loop thread only, so the endpoint table needs no lock
+    if rpc not in endpoints:
+        connector = aiohttp.TCPConnector(limit=64)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+        endpoints[rpc] = (session, asyncio.Semaphore(RPC_CONCURRENCY))  # one limit per chain endpoint, shared by all callers
+    session, sem = endpoints[rpc]
+    return await asyncio.gather(*[_post_rpc(session, sem, rpc, i, method, params) for i, (method, params) in enumerate(calls)], return_exceptions=True)
+
+def rpc_calls(rpc, calls):
+    """Send (method, params) JSON-RPC calls concurrently; returns each result, or None where the call failed.
+    Safe to call from any thread: the calls are scheduled on the shared RPC loop."""
+    loop, endpoints = _rpc_loop()
+    results = asyncio.run_coroutine_threadsafe(_gather_rpc(rpc, calls, endpoints), loop).result()
+    return [None if isinstance(r, BaseException) else r for r in results]
+
+def _aggregate3(rpc, calls, blk):
+    """Run (target, calldata) pairs through Multicall3, one concurrent eth_call per chunk; returns returndata per call (None on failure)"""
+    block = hex(blk) if isinstance(blk, int) else blk
+    payloads = []
+    for start in range(0, len(calls), MULTICALL_BATCH_SIZE):
+        chunk = [(target, True, data) for target, data in calls[start:start + MULTICALL_BATCH_SIZE]]
+        data = AGGREGATE3_SELECTOR + encode(['(address,bool,bytes)[]'], [chunk])
+        payloads.append(("eth_call", [{"to": MULTICALL3, "data": "0x" + data.hex()}, block]))
+    results = []
+    for ret in rpc_calls(rpc, payloads):
+        if not ret or ret == "0x":
+            raise ValueError("Multicall3 aggregate3 call failed")
+        (chunk_results,) = decode(['(bool,bytes)[]'], bytes.fromhex(ret[2:]))
+        results.extend(data if ok and len(data) >= 32 else None for ok, data in chunk_results)
+    return results
+
+def multicall_balances(rpc, calls, blk, decimals_for=()):
+    """Fetch raw balances for (token, wallet) pairs, plus decimals() of the `decimals_for` tokens, in the same
+    aggregate3 batch (one eth_call per chunk). token=None means native balance. Returns (raws, {token: decimals}).
+    Addresses are the lowercase lookup keys: ABI encoding does not need checksums, so no keccak per call."""
+    # Encode each unique wallet argument once; wallets usually repeat across many tokens
+    args = {wallet: encode(['address'], [wallet]) for wallet in {w for _, w in calls}}
+    encoded = [(MULTICALL3, GET_ETH_BALANCE_SELECTOR + args[wallet]) if token is None else (token, BALANCE_OF_SELECTOR + args[wallet])
+               for token, wallet in calls]
+    encoded += [(token, DECIMALS_SELECTOR) for token in decimals_for]
+    rets = [int.from_bytes(ret[:32], 'big') if ret is not None else None for ret in _aggregate3(rpc, encoded, blk)]
+    # A failed balanceOf/decimals() stays None; fetch_onchain keeps such results out of its cache.
+    # decimals() is a uint8: a word above 255 is not a valid answer, as a strict ABI decode would reject it.
+    return rets[:len(calls)], {t: d if d is not None and d <= 255 else None for t, d in zip(decimals_for, rets[len(calls):])}
+
+# Caps in-flight web3 fallback calls per chain, even when several (chain, block) groups run at once
+_CHAIN_SLOTS = {chain_id: threading.BoundedSemaphore(RPC_CONCURRENCY) for chain_id in CHAIN_CONFIG}
+
+def _fetch_decimals(rpc, token):
+    """fetch_token_decimals, None on failure"""
+    try:
+        return fetch_token_decimals(rpc, token)
+    except Exception:
+        return None
+
+def _fetch_lookup(chain_id, token, addr, blk):
+    """Single balance lookup through web3.py; None on failure"""
+    rpc = CHAIN_CONFIG[chain_id]["rpc"]
+    try:
+        with _CHAIN_SLOTS[chain_id]:
+            return fetch_native(rpc, addr, blk) if token is None else fetch_erc20(rpc, token, addr, blk)
+    except Exception:
+        return None
+
+def _resolve_group(chain_id, blk, lookups, tokens):
+    """Balances for one (chain, block) group plus decimals for `tokens`; returns (raws, {token: decimals})"""
+    rpc_url = CHAIN_CONFIG[chain_id]["rpc"]
+    try:
+        return multicall_balances(rpc_url, lookups, blk, tokens)
+    except Exception:
+        # Multicall3 unavailable (e.g. block predates its deployment) - fall back to one call per lookup,
+        # run on a thread pool: requests releases the GIL while waiting on the socket
+        with ThreadPoolExecutor(max_workers=RPC_CONCURRENCY) as executor:
+            token_decimals = executor.map(lambda t: _fetch_decimals(rpc_url, t), tokens)
+            raws = list(executor.map(lambda lookup: _fetch_lookup(chain_id, *lookup, blk), lookups))
+            return raws, dict(zip(tokens, token_decimals))
+
+def resolve_pending(pending, progress=None, resolved_decimals=None):
+    """Resolve {(chain_id, blk): {(token, wallet)}} lookups with one aggregate3 batch per (chain, block) that carries
+    both the balances and the decimals() of tokens not resolved yet on that chain. Groups run concurrently (e.g. one
+    per chain). `progress["done"]` (if given) counts finished groups for a caller polling from another thread, and
+    setting `progress["cancelled"]` makes groups not yet started raise CancelledError.
+    Returns (balances, decimals) with None for failed lookups; `resolved_decimals` entries are not re-requested."""
+    balances = {}  # (chain_id, blk, token, wallet) -> raw balance or None
+    decimals = dict(resolved_decimals or {})  # (chain_id, token) -> decimals, or None where decimals() failed
+    groups = []
+    for (chain_id, blk), lookups in pending.items():
+        lookups = list(lookups)
+        known = KNOWN_DECIMALS.get(chain_id, {})
+        # Each unknown token's decimals are requested by the first group on its chain that holds it
+        tokens = {token for token, _ in lookups if token is not None and (chain_id, token) not in decimals}
+        for token in tokens:
+            decimals[(chain_id, token)] = known.get(token)
+        groups.append((chain_id, blk, lookups, [t for t in tokens if t not in known]))
+    if progress is not None:
+        progress["total"] = len(groups)
     
-    return closest_block
+    with ThreadPoolExecutor(max_workers=max(1, min(len(groups), 8))) as executor:
+        def resolve(group):
+            if progress is not None and progress.get("cancelled"):
+                raise CancelledError("superseded by a newer validation run")
+            return _resolve_group(*group)
+        results = executor.map(resolve, groups)
+        for (chain_id, blk, lookups, _), (raws, chain_decimals) in zip(groups, results):
+            for (token, addr), raw in zip(lookups, raws):
+                balances[(chain_id, blk, token, addr)] = raw
+            for token, d in chain_decimals.items():
+                decimals[(chain_id, token)] = d
+            if progress is not None:
+                progress["done"] += 1
+    return balances, decimals
+
+ONCHAIN_TTL = 3600  # seconds a fully resolved fetch is reused
+
+@st.cache_resource
+def _onchain_cache():
+    """Process-wide {job_key: (stored_at, (balances, decimals))} holding fully resolved fetches only, plus its lock.
+    Kept by hand rather than with st.cache_data so an incomplete result is returned without being cached."""
+    return {}, threading.Lock()
+
+def _store_complete(job_key, balances, decimals):
+    """Cache (balances, decimals) under job_key if every lookup resolved; returns whether it did"""
+    complete = None not in balances.values() and None not in decimals.values()
+    if complete:
+        cache, lock = _onchain_cache()
+        now = time.time()
+        with lock:
+            for key in [key for key, (stored_at, _) in cache.items() if now - stored_at > ONCHAIN_TTL]:
+                del cache[key]
+            cache[job_key] = (now, (balances, decimals))
+    return complete
+
+def fetch_onchain(job_key, pending, progress=None):
+    """resolve_pending, cached per job_key (upload + mapping + blocks; `pending` is fully determined by it).
+    Returns (balances, decimals, complete); only a complete result is cached, so failed lookups are retried."""
+    cache, lock = _onchain_cache()
+    with lock:
+        hit = cache.get(job_key)
+    if hit and time.time() - hit[0] <= ONCHAIN_TTL:
+        return (*hit[1], True)
+    balances, decimals = resolve_pending(pending, progress)
+    return balances, decimals, _store_complete(job_key, balances, decimals)
+
+def retry_incomplete(job_key, balances, decimals, progress=None):
+    """Re-query only the lookups an incomplete fetch left unresolved (failed balance, or token decimals still
+    unknown) and merge them into its result; returns (balances, decimals, complete) like fetch_onchain"""
+    balances = dict(balances)
+    decimals = {key: d for key, d in decimals.items() if d is not None}
+    retry = {}
+    for (chain_id, blk, token, wallet), raw in balances.items():
+        if raw is None or (token is not None and (chain_id, token) not in decimals):
+            retry.setdefault((chain_id, blk), set()).add((token, wallet))
+    retried, decimals = resolve_pending(retry, progress, decimals)
+    balances.update(retried)
+    return balances, decimals, _store_complete(job_key, balances, decimals)
+
+# Unbounded precision so scaleb/to_integral_value never round the reported digits (the default context keeps 28);
+# Emax bounds the result well above any uint256 amount, so absurd exponents fail fast instead of building huge ints
+_UNITS_CTX = Context(prec=MAX_PREC, Emax=100)
+
+def to_base_units(text, decimals):
+    """Reported balance text -> integer amount in the token's smallest unit (exact, unlike float * 10**decimals)"""
+    try:
+        return int(Decimal(text).scaleb(decimals, context=_UNITS_CTX).to_integral_value(context=_UNITS_CTX))
+    except (DecimalException, OverflowError, ValueError, TypeError):
+        return None
+
+def scale_down(ints, decimals):
+    """ints / 10**decimals as a float64 array. Values below 2**53 (and decimals up to 22, where 10.0**d is exact)
+    divide in NumPy with the same correctly-rounded result as Python's int division; larger ones use Python ints."""
+    ints = np.asarray(ints, dtype=object)
+    decimals = np.asarray(decimals, dtype=np.int64)
+    f = ints.astype(np.float64)
+    fast = (np.abs(f) < 2.0 ** 53) & (decimals <= 22)
+    out = np.empty(len(ints))
+    out[fast] = f[fast] / np.power(10.0, decimals[fast])
+    out[~fast] = [int(v) / 10 ** int(d) for v, d in zip(ints[~fast], decimals[~fast])]
+    return out
+
+def tolerance_flags(delta, reported, tol):
+    """|delta| <= tol * |reported| over float64 arrays; NaN (missing balance) compares False"""
+    return np.abs(delta) <= tol * np.maximum(np.abs(reported), 1e-18)
 
 @st.cache_data
-def fetch_token_decimals(rpc, token):
-    w3 = make_w3(rpc)
-    c = w3.eth.contract(address=Web3.to_checksum_address(token), abi=ERC20_ABI)
-    try: 
-        decimals = c.functions.decimals().call()
-        return int(decimals)
-    except: 
-        return 18  # default fallback
+def to_csv_bytes(df):
+    """Serialize the report once per distinct frame; reruns with an unchanged report reuse the bytes.
+    Arrow writes UTF-8 straight into the buffer, without building the whole CSV as a Python str first."""
+    buf = io.BytesIO()
+    try:
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return df.to_csv(index=False).encode()  # a column Arrow cannot type, e.g. mixed objects
+    return buf.getvalue()
 
-def fetch_erc20(rpc, token, addr, blk):
-    w3 = make_w3(rpc)
+@st.cache_data
+def to_parquet_bytes(df):
+    """Columnar, typed copy of the report; smaller and faster to write and reload than the CSV.
+    Text columns can hold mixed Python objects (e.g. an int symbol next to "AVAX"), so they are written as strings;
+    returns None if Arrow still cannot type the frame, and the caller hides the button."""
+    text = {c: "string" for c in ("chain", "wallet", "token", "error") if c in df.columns}
     try:
-        c = w3.eth.contract(address=Web3.to_checksum_address(token), abi=ERC20_ABI)
-        balance = c.functions.balanceOf(Web3.to_checksum_address(addr)).call(block_identifier=blk)
-        return int(balance)
-    except Exception as e: 
-        # Return None on error, let caller handle the error message
+        return df.astype(text).to_parquet(index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
         return None
 
+@st.cache_data
+def load_upload(name, blob):
+    """Parse the uploaded file once per content; every widget change reruns the script"""
+    # Every column is read as text: a balance parsed to float64 first would lose digits before to_base_units
+    # sees it, and hex strings must stay as typed. Numeric columns are parsed explicitly later.
+    if name.endswith('.csv'):
+        # Arrow's multithreaded parser first. The C engine is kept for inputs it rejects (and for its error message),
+        # and for duplicate headers, which Arrow keeps as-is but the C engine renames ("a", "a.1")
+        try:
+            names = pacsv.open_csv(io.BytesIO(blob)).schema.names
+            if len(set(names)) == len(names):
+                text = pacsv.ConvertOptions(column_types={n: pa.string() for n in names}, strings_can_be_null=True)
+                return pacsv.read_csv(io.BytesIO(blob), convert_options=text).to_pandas()
+        except pa.ArrowInvalid:
+            pass
+        return pd.read_csv(io.BytesIO(blob), dtype=str)
+    # calamine (Rust) parses XLSX an order of magnitude faster than the default openpyxl engine
+    return pd.read_excel(io.BytesIO(blob), engine='calamine', dtype=str)
+
 # --- Sidebar ---
 st.sidebar.header("Balance Validation Settings")
 
@@ -230,12 +594,13 @@ validation_mode = st.sidebar.radio(
     help="Current: Latest blockchain state. Historical: Balances at a specific date/time."
 )
 
+refresh_tip = False
 if validation_mode == "Historical Balances":
     st.sidebar.subheader("Historical Date/Time")
     col1, col2, col3 = st.sidebar.columns(3)
     with col1: asof_date = st.date_input("Date", dt.date.today())
     with col2: asof_time = st.time_input("Time", dt.time(23,59,59))
-    with col3: tzname = st.selectbox("Timezone", pytz.all_timezones, index=pytz.all_timezones.index("UTC"))
+    with col3: tzname = st.selectbox("Timezone", _TZS, index=_TZ_UTC_IDX)
     
     blk_input = st.sidebar.text_input("Block number (optional)", help="Leave empty to auto-detect block from timestamp")
     explicit_blk = int(blk_input) if blk_input.strip().isdigit() else None
@@ -244,6 +609,14 @@ else:
     asof_time = None
     tzname = None
     explicit_blk = None
+    refresh_tip = st.sidebar.button("Refresh to latest block", help="Current balances are checked at the block fetched on first run for this upload; refresh to move to the chain tip")
+
+st.sidebar.divider()
+tolerance = st.sidebar.number_input(
+    "Relative tolerance",
+    min_value=0.0, value=1e-6, format="%.2e",
+    help="A row is within tolerance when |onchain - reported| <= tolerance × |reported|"
+)
 
 # --- Upload ---
 upload = st.file_uploader("Upload Bitwave CSV/XLSX", type=["csv","xlsx"])
@@ -251,26 +624,29 @@ if not upload:
     st.info("Upload file to start.")
     st.stop()
 
-df = pd.read_csv(upload) if upload.name.endswith('.csv') else pd.read_excel(upload)
+df = load_upload(upload.name, upload.getvalue())
 st.dataframe(df.head())
 
 cols = list(df.columns)
 
+def _norm(name):
+    return name.lower().replace(' ', '').replace('_', '')
+
+# Normalized/lowercased column names, computed once per upload rather than per keyword comparison
+cols_norm = [(col, _norm(col), col.lower()) for col in cols]
+
 # Better column matching - exact match first, then partial
 def find_column(keywords):
     # First try exact match (case insensitive)
-    for col in cols:
-        col_lower = col.lower().replace(' ', '').replace('_', '')
-        for keyword in keywords:
-            keyword_lower = keyword.lower().replace(' ', '').replace('_', '')
-            if col_lower == keyword_lower:
-                return col
+    keywords_norm = {_norm(keyword) for keyword in keywords}
+    for col, col_norm, _ in cols_norm:
+        if col_norm in keywords_norm:
+            return col
     # Then try partial match
-    for col in cols:
-        col_lower = col.lower()
-        for keyword in keywords:
-            if keyword.lower() in col_lower:
-                return col
+    keywords_lower = [keyword.lower() for keyword in keywords]
+    for col, _, col_lower in cols_norm:
+        if any(keyword in col_lower for keyword in keywords_lower):
+            return col
     return None
 
 # Auto-suggest columns with better matching (prioritize exact matches)
@@ -350,7 +726,9 @@ if use_manual_chain:
     st.info(f"🔧 **Manual Override:** All entries will be validated on **{CHAIN_CONFIG[manual_chain]['name']}**")
     df['_chain_id'] = manual_chain
 elif cmap.chain:
-    df['_chain_id'] = df[cmap.chain].apply(identify_chain)
+    # Unrecognized or blank chains map to NaN (truthy); use None so they're reported as "Unknown" like before
+    chain_ids = df[cmap.chain].astype(str).str.strip().str.lower().map(ALIAS_TO_CHAIN).astype(object)
+    df['_chain_id'] = chain_ids.where(chain_ids.notna(), None)
     chains_in_data = df['_chain_id'].dropna().unique()
     st.write(f"**Chains detected in data:** {', '.join([CHAIN_CONFIG[c]['name'] for c in chains_in_data if c in CHAIN_CONFIG])}")
     
@@ -363,68 +741,189 @@ else:
     st.warning("⚠️ No chain column mapped. Assuming all entries are for the first configured chain.")
     df['_chain_id'] = list(configured_chains.keys())[0]
 
-res = []
+# Vectorized preprocessing: normalize the mapped columns in one pass instead of per row
+addrs = df[cmap.address].astype(str).str.strip().fillna("")
+if cmap.token_contract:
+    tokens = df[cmap.token_contract].astype(str).str.strip().fillna("")
+    is_native = ~tokens.str.match(_ADDR_RE)
+else:
+    tokens = pd.Series(None, index=df.index, dtype=object)
+    is_native = pd.Series(True, index=df.index)
+reported_text = df[cmap.reported_balance].astype(str).str.replace(',', '', regex=False).str.strip()
+reported = pd.to_numeric(reported_text, errors='coerce')
+addr_valid = addrs.str.match(_WALLET_RE)
+# Case-normalized lookup keys, so the same wallet/token spelled differently is fetched once
+wallet_keys = "0x" + addrs.str.lower().str.removeprefix("0x")
+token_keys = tokens.str.lower() if cmap.token_contract else tokens
+
+# Slim frame of just the mapped columns; the loop zips over its column arrays (no per-row Series or tuples)
+sub = pd.DataFrame({
+    "address": addrs,
+    "token": tokens,
+    "is_native": is_native,
+    "addr_valid": addr_valid,
+    "wallet_key": wallet_keys,
+    "token_key": token_keys,
+    "symbol": df[cmap.token_symbol] if cmap.token_symbol else "TOKEN",
+    "reported": reported,
+    "reported_text": reported_text,
+    "chain_id": df['_chain_id'],
+})
+# Pass 1: resolve chain/block per row and collect unique balance lookups per (chain, block).
+# Results are written column-wise by row position, so no per-row dicts and no type inference over them.
+n_rows = len(sub)
+out_cols = {"row": list(range(1, n_rows + 1)), "chain": [None] * n_rows, "wallet": [None] * n_rows, "token": [None] * n_rows,
+            "reported": [None] * n_rows, "onchain": [None] * n_rows, "delta": [None] * n_rows, "error": [None] * n_rows}
+
+def record(i, chain, wallet, token, reported, onchain=None, delta=None, error=None):
+    out_cols["chain"][i] = chain
+    out_cols["wallet"][i] = wallet
+    out_cols["token"][i] = token
+    out_cols["reported"][i] = reported
+    out_cols["onchain"][i] = onchain
+    out_cols["delta"][i] = delta
+    out_cols["error"][i] = error
+
+# Resolve the validation block once per chain: every row on a chain shares it
+blk_per_chain = {}  # chain_id -> block number
+blk_errors = {}     # chain_id -> error message for its rows
+block_notes = []    # (chain_id, level, message) from the block search, rendered after the loop
+file_hash = hashlib.sha256(upload.getvalue()).hexdigest()
+# Current mode pins the tip block per session and upload: a fresh eth_blockNumber on every rerun would change
+# the fetch cache key, so every widget change would refetch every balance
+pinned_tips = st.session_state.setdefault("pinned_tips", {})  # (file_hash, chain_id) -> block
+if refresh_tip:
+    pinned_tips.clear()
+if validation_mode != "Current Balances":
+    local_dt = dt.datetime.combine(asof_date, asof_time)
+    utc_ts = int(local_dt.replace(tzinfo=ZoneInfo(tzname)).astimezone(dt.timezone.utc).timestamp())
+for chain_id in df['_chain_id'].dropna().unique():
+    if chain_id not in configured_chains:
+        continue
+    try:
+        if validation_mode == "Current Balances":
+            if (file_hash, chain_id) not in pinned_tips:
+                pinned_tips[(file_hash, chain_id)] = make_w3(CHAIN_CONFIG[chain_id]["rpc"]).eth.block_number
+            blk_per_chain[chain_id] = pinned_tips[(file_hash, chain_id)]
+        elif explicit_blk:
+            blk_per_chain[chain_id] = explicit_blk
+        else:
+            blk_per_chain[chain_id], note = block_for_timestamp(chain_id, utc_ts)
+            if note:
+                block_notes.append((chain_id,) + note)
+    except Exception as e:
+        blk_errors[chain_id] = f"RPC Error: {str(e)[:100]}"
+
+jobs = []     # rows still waiting on a balance lookup
+pending = {}  # (chain_id, blk) -> {(token or None for native, wallet)}
 with st.spinner("Fetching on-chain balances..."):
     progress_bar = st.progress(0)
+    # Each progress() call is a websocket message to the browser, so update ~100 times at most
+    progress_every = max(1, len(sub) // 100)
     
-    for i, r in df.iterrows():
-        progress_bar.progress((i + 1) / len(df))
-        addr = str(r[cmap.address]).strip()
-        token_raw = str(r[cmap.token_contract]).strip() if cmap.token_contract else None
-        rep = human_to_decimal(r[cmap.reported_balance])
-        chain_id = r.get('_chain_id')
+    columns = (sub[c].to_numpy() for c in sub.columns)
+    for i, (addr, token_raw, native, addr_ok, wallet_key, token_key, symbol, rep, rep_text, chain_id) in enumerate(zip(*columns)):
+        if i % progress_every == 0:
+            progress_bar.progress(i / len(sub))
         
         # Validate chain
         if not chain_id or chain_id not in configured_chains:
-            res.append({"row": i+1, "chain": chain_id or "Unknown", "wallet": addr,"token": token_raw or "N/A","reported": rep,"onchain": None,"delta": None,"error": "Chain not configured or not recognized"})
+            record(i, chain_id or "Unknown", addr, token_raw or "N/A", rep, error="Chain not configured or not recognized")
             continue
         
         chain_config = CHAIN_CONFIG[chain_id]
-        rpc_url = chain_config["rpc"]
         native_token = chain_config["native_token"]
         
-        # Get block number for this chain with error handling
-        try:
-            if validation_mode == "Current Balances":
-                blk = make_w3(rpc_url).eth.block_number
-            else:
-                local_dt = dt.datetime.combine(asof_date, asof_time)
-                utc_ts = int(pytz.timezone(tzname).localize(local_dt).astimezone(pytz.UTC).timestamp())
-                if explicit_blk:
-                    blk = explicit_blk
-                else:
-                    blk = find_block_by_timestamp(rpc_url, utc_ts)
-        except Exception as e:
-            res.append({"row": i+1, "chain": chain_config["name"], "wallet": addr,"token": token_raw or native_token,"reported": rep,"onchain": None,"delta": None,"error": f"RPC Error: {str(e)[:100]}"})
+        if chain_id in blk_errors:
+            record(i, chain_config["name"], addr, token_raw or native_token, rep, error=blk_errors[chain_id])
             continue
+        blk = blk_per_chain[chain_id]
         
         # Validate wallet address (basic check)
         if not addr or len(addr) < 10:
-            res.append({"row": i+1, "chain": chain_config["name"], "wallet": addr,"token": token_raw or native_token,"reported": rep,"onchain": None,"delta": None,"error": "Invalid or empty wallet address"})
+            record(i, chain_config["name"], addr, token_raw or native_token, rep, error="Invalid or empty wallet address")
             continue
-            
-        try:
-            if _is_native(token_raw):
-                try:
-                    bal = fetch_native(rpc_url, addr, blk) / 1e18
-                    sym = native_token
-                except Exception as e:
-                    res.append({"row": i+1, "chain": chain_config["name"], "wallet": addr,"token": native_token,"reported": rep,"onchain": None,"delta": None,"error": f"Invalid address format: {str(e)}"})
-                    continue
+        
+        token = None if native else token_key
+        if not addr_ok:
+            if token is None:
+                record(i, chain_config["name"], addr, native_token, rep, error="Invalid address format: expected 40 hex characters")
             else:
-                raw = fetch_erc20(rpc_url, token_raw, addr, blk)
-                if raw is None:
-                    res.append({"row": i+1, "chain": chain_config["name"], "wallet": addr,"token": token_raw,"reported": rep,"onchain": None,"delta": None,"error": "Failed to fetch balance"})
-                    continue
-                decimals = fetch_token_decimals(rpc_url, token_raw)
-                bal = raw / (10 ** decimals)
-                sym = r.get(cmap.token_symbol,"TOKEN") if cmap.token_symbol else "TOKEN"
-            res.append({"row": i+1, "chain": chain_config["name"], "wallet": addr,"token": sym,"reported": rep,"onchain": bal,"delta": (bal-rep if rep is not None else None)})
-        except Exception as e:
-            res.append({"row": i+1, "chain": chain_config["name"], "wallet": addr,"token": token_raw if token_raw else native_token,"reported": rep,"onchain": None,"delta": None,"error": f"Error: {str(e)}"})
+                record(i, chain_config["name"], addr, token_raw, rep, error="Failed to fetch balance")
+            continue
+        
+        # Each unique (token, wallet) is queried once per (chain, block) and joined back in pass 3
+        pending.setdefault((chain_id, blk), set()).add((token, wallet_key))
+        jobs.append((i, symbol, chain_id, blk, token, wallet_key, addr, token_raw, rep, rep_text))
+    progress_bar.progress(1.0)
+
+    # Pass 2: cached per upload + mapping + blocks, so widget reruns skip the RPC round-trips.
+    # It runs on this session's background worker, tracked in session_state: a widget change mid-fetch interrupts
+    # this script run, and the next run waits on the same in-flight job instead of starting the RPCs over.
+    # A job that finished with failed lookups is retried for those lookups only; one that raised starts over.
+    job_key = (file_hash, astuple(cmap) + (manual_chain,), tuple(sorted(pending)))
+    job = st.session_state.get("validation_job")
+    superseded = job is not None and job[0] != job_key
+    if job is None or superseded or (job[1].done() and (job[1].exception() is not None or not job[1].result()[2])):
+        if "validation_executor" not in st.session_state:
+            st.session_state["validation_executor"] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="validation")
+        executor = st.session_state["validation_executor"]
+        progress = {"done": 0, "total": len(pending), "cancelled": False}
+        if superseded:  # new upload, mapping or block: drop the old job if queued, stop its remaining groups
+            job[1].cancel()
+            job[2]["cancelled"] = True
+        if job is not None and not superseded and job[1].exception() is None:
+            future = executor.submit(retry_incomplete, job_key, *job[1].result()[:2], progress)
+        else:
+            future = executor.submit(fetch_onchain, job_key, pending, progress)
+        job = (job_key, future, progress)
+        st.session_state["validation_job"] = job
+    _, future, progress = job
+    while not future.done():
+        progress_bar.progress(progress["done"] / max(progress["total"], 1))
+        time.sleep(0.5)
+    balances, decimals, _ = future.result()  # failed lookups (None) are retried on the next run
+    decimals = {key: 18 if d is None else d for key, d in decimals.items()}  # decimals() failed: assume 18, as before
     progress_bar.empty()
-
-out = pd.DataFrame(res)
+st.caption(f"{len(jobs)} rows resolved with {sum(len(lookups) for lookups in pending.values())} unique balance lookups")
+
+# Pass 3: join fetched balances back onto the waiting rows, collecting the raw integers for one vectorized scaling.
+# Deltas are exact integer differences in base units; only the displayed values are floats.
+found_pos, found_raw, found_dec = [], [], []  # rows with a balance
+diff_pos, diff_raw, diff_dec = [], [], []     # rows whose reported text also converted to base units
+for i, symbol, chain_id, blk, token, wallet, addr, token_raw, rep, rep_text in jobs:
+    chain_config = CHAIN_CONFIG[chain_id]
+    raw = balances[(chain_id, blk, token, wallet)]
+    if raw is None:
+        record(i, chain_config["name"], addr, token_raw if token else chain_config["native_token"], rep, error="Failed to fetch balance")
+        continue
+    if token is None:
+        dec, sym = NATIVE_DECIMALS, chain_config["native_token"]
+    else:
+        dec, sym = decimals[(chain_id, token)], symbol
+    record(i, chain_config["name"], addr, sym, rep)
+    found_pos.append(i); found_raw.append(raw); found_dec.append(dec)
+    rep_units = to_base_units(rep_text, dec)
+    if rep_units is not None:
+        diff_pos.append(i); diff_raw.append(raw - rep_units); diff_dec.append(dec)
+
+out = pd.DataFrame(out_cols).astype({"reported": "float64", "onchain": "float64", "delta": "float64"})
+onchain = out["onchain"].to_numpy(copy=True)
+onchain[found_pos] = scale_down(found_raw, found_dec)
+delta = onchain - out["reported"].to_numpy()  # float fallback where the reported text has no exact form
+delta[diff_pos] = scale_down(diff_raw, diff_dec)
+out["onchain"], out["delta"] = onchain, delta
+out["within_tolerance"] = tolerance_flags(out["delta"].to_numpy(), out["reported"].to_numpy(), tolerance)
+
+# Render collected messages after the loop, rather than as elements interleaved with it
+for chain_id, level, message in block_notes:
+    getattr(st, level)(f"{CHAIN_CONFIG[chain_id]['name']}: {message}")
 st.dataframe(out)
-csv = out.to_csv(index=False).encode()
-st.download_button("Download CSV", csv, "validation_report.csv", "text/csv")
+errors = out[out["error"].notna()]
+if len(errors):
+    with st.expander(f"⚠️ {len(errors)} rows with errors"):
+        st.dataframe(errors)
+st.download_button("Download CSV", to_csv_bytes(out), "validation_report.csv", "text/csv")
+parquet = to_parquet_bytes(out)
+if parquet is not None:
+    st.download_button("Download Parquet", parquet, "validation_report.parquet", "application/vnd.apache.parquet")